@@ -14,6 +14,7 @@ from xiaomusic.api.dependencies import (
     AuthStaticFiles,
     reset_http_server,
 )
+from xiaomusic.utils.async_http_client import close_http_client
 
 if TYPE_CHECKING:
     from xiaomusic.xiaomusic import XiaoMusic
@@ -45,6 +46,8 @@ async def app_lifespan(app):
             except Exception as e:
                 if _state.is_initialized():
                     _state._log.error(f"Background task cleanup error: {e}")
+        # 释放共享 HTTP 连接池
+        await close_http_client()
 
 
 # 创建 FastAPI 应用实例
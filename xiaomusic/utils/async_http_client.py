@@ -5,10 +5,32 @@
 """
 
 import asyncio
+import codecs
 import logging
-from typing import Optional, Dict, List, Any
+from typing import Any, Literal
+from collections.abc import AsyncIterator
 
 import aiohttp
+import msgspec
+
+
+def _json_dumps(obj: Any) -> str:
+    """使用 msgspec 序列化请求体，比标准库 json 快得多"""
+    return msgspec.json.encode(obj).decode()
+
+
+async def _read_json(resp: aiohttp.ClientResponse) -> Any:
+    """读取原始响应体后用 msgspec 解析 JSON
+
+    响应体为空时返回 None；非 UTF-8 编码的响应先按其字符集解码
+    """
+    raw = await resp.read()
+    if not raw.strip():
+        return None
+    encoding = resp.get_encoding()
+    if codecs.lookup(encoding).name != "utf-8":
+        return msgspec.json.decode(raw.decode(encoding))
+    return msgspec.json.decode(raw)
 
 
 class AsyncHttpClient:
@@ -17,29 +39,71 @@ class AsyncHttpClient:
     def __init__(self, timeout: int = 30):
         self.timeout = aiohttp.ClientTimeout(total=timeout)
         self.log = logging.getLogger(__name__)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """获取共享的 ClientSession，首次使用时创建
+
+        复用同一个连接池，避免每次请求都重新建立 TCP/TLS 连接
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=64,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=connector,
+                json_serialize=_json_dumps,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """关闭共享的 ClientSession"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def get(
-        self, url: str, headers: Optional[Dict[str, str]] = None, json_data: bool = False
-    ) -> Optional[Dict[str, Any]]:
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        json_data: bool = False,
+        mode: Literal["text", "json", "bytes"] | None = None,
+    ) -> Any | None:
         """异步 GET 请求
 
         Args:
             url: 请求 URL
             headers: 请求头
-            json_data: 是否返回 JSON 格式
+            json_data: 是否返回 JSON 格式（兼容旧参数，等同于 mode="json"）
+            mode: 返回格式，"text" 为字符串，"json" 为解析后的对象，
+                "bytes" 为原始字节（不做解码，适合转发或落盘）；
+                未指定时由 json_data 决定，默认 "text"
 
         Returns:
             响应数据或 None
+
+        Raises:
+            ValueError: json_data 与 mode 同时指定且互相冲突
         """
+        if mode is None:
+            mode = "json" if json_data else "text"
+        elif json_data and mode != "json":
+            raise ValueError(f"json_data=True 与 mode={mode!r} 冲突")
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.get(url, headers=headers) as resp:
-                    if resp.status == 200:
-                        if json_data:
-                            return await resp.json()
-                        return await resp.text()
-                    self.log.warning(f"GET {url} 失败: HTTP {resp.status}")
-                    return None
+            session = await self._ensure_session()
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 200:
+                    if mode == "json":
+                        return await _read_json(resp)
+                    if mode == "bytes":
+                        return await resp.read()
+                    return await resp.text()
+                self.log.warning(f"GET {url} 失败: HTTP {resp.status}")
+                return None
         except asyncio.TimeoutError:
             self.log.error(f"GET {url} 超时")
             return None
@@ -47,33 +111,65 @@ class AsyncHttpClient:
             self.log.error(f"GET {url} 异常: {e}")
             return None
 
+    async def stream_get(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        chunk_size: int = 64 * 1024,
+    ) -> AsyncIterator[bytes]:
+        """流式 GET 请求，按块返回响应体，适合下载大文件
+
+        与 get/post 不同，失败时直接抛出异常而不是静默结束，
+        以便调用方区分下载完成与中途失败
+
+        Args:
+            url: 请求 URL
+            headers: 请求头
+            chunk_size: 每块字节数
+
+        Yields:
+            响应体数据块
+
+        Raises:
+            aiohttp.ClientResponseError: 响应状态码为 4xx/5xx
+            aiohttp.ClientError: 连接中断、响应体不完整等传输错误
+            asyncio.TimeoutError: 连接或读取超时
+        """
+        # 大文件下载不限制总时长，只限制连接和单次读取的等待时间
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.timeout.total,
+            sock_read=self.timeout.total,
+        )
+        session = await self._ensure_session()
+        async with session.get(url, headers=headers, timeout=timeout) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
     async def post(
-        self, url: str, data: Optional[Dict[str, Any]] = None, json: bool = True
-    ) -> Optional[Dict[str, Any]]:
+        self, url: str, data: dict[str, Any] | None = None, json: bool = True
+    ) -> dict[str, Any] | str | None:
         """异步 POST 请求
 
         Args:
             url: 请求 URL
             data: 请求数据
-            json: 是否使用 JSON 格式
+            json: 是否使用 JSON 格式（同时决定响应按 JSON 还是文本返回）
 
         Returns:
             响应数据或 None
         """
+        kwargs = {"json": data} if json else {"data": data}
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                if json:
-                    async with session.post(url, json=data) as resp:
-                        if resp.status == 200:
-                            return await resp.json()
-                        self.log.warning(f"POST {url} 失败: HTTP {resp.status}")
-                        return None
-                else:
-                    async with session.post(url, data=data) as resp:
-                        if resp.status == 200:
-                            return await resp.text()
-                        self.log.warning(f"POST {url} 失败: HTTP {resp.status}")
-                        return None
+            session = await self._ensure_session()
+            async with session.post(url, **kwargs) as resp:
+                if resp.status == 200:
+                    if json:
+                        return await _read_json(resp)
+                    return await resp.text()
+                self.log.warning(f"POST {url} 失败: HTTP {resp.status}")
+                return None
         except asyncio.TimeoutError:
             self.log.error(f"POST {url} 超时")
             return None
@@ -82,25 +178,42 @@ class AsyncHttpClient:
             return None
 
     async def batch_get(
-        self, urls: List[str], headers: Optional[Dict[str, str]] = None
-    ) -> Dict[str, Optional[Any]]:
+        self,
+        urls: list[str],
+        headers: dict[str, str] | None = None,
+        concurrency: int = 32,
+    ) -> dict[str, Any | None]:
         """批量 GET 请求（并发）
 
         Args:
             urls: URL 列表
             headers: 请求头
+            concurrency: 最大并发请求数
 
         Returns:
-            URL 到响应数据的映射
+            URL 到响应数据的映射，失败的请求对应 None（重复的 URL 只请求一次）
         """
-        tasks = [self.get(url, headers) for url in urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        sem = asyncio.Semaphore(max(1, concurrency))
+        unique_urls = list(dict.fromkeys(urls))
+
+        # get 内部已捕获请求异常并返回 None，这里的子任务不会因请求失败而抛出
+        async def _one(url: str) -> Any | None:
+            async with sem:
+                return await self.get(url, headers)
+
+        if not hasattr(asyncio, "TaskGroup"):
+            # Python 3.10 没有 TaskGroup，退回 gather
+            results = await asyncio.gather(*[_one(url) for url in unique_urls])
+            return dict(zip(unique_urls, results))
 
-        return dict(zip(urls, results))
+        # TaskGroup 保证 batch_get 被取消时所有子请求一并取消
+        async with asyncio.TaskGroup() as tg:
+            tasks = {url: tg.create_task(_one(url)) for url in unique_urls}
+        return {url: task.result() for url, task in tasks.items()}
 
 
 # 全局单例
-_http_client: Optional[AsyncHttpClient] = None
+_http_client: AsyncHttpClient | None = None
 
 
 def get_http_client() -> AsyncHttpClient:
@@ -109,3 +222,9 @@ def get_http_client() -> AsyncHttpClient:
     if _http_client is None:
         _http_client = AsyncHttpClient()
     return _http_client
+
+
+async def close_http_client() -> None:
+    """关闭全局 HTTP 客户端（应在事件循环结束前调用）"""
+    if _http_client is not None:
+        await _http_client.close()
@@ -5,108 +5,346 @@
 """
 
 import asyncio
+import collections
+import functools
 import json
 import os
-import pickle
+import struct
+import threading
 import time
 import hashlib
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any
+from collections.abc import Awaitable, Callable, Iterator
 from datetime import datetime
 import logging
 
+import msgspec
+
+# 缓存文件使用 msgpack 编码，比 pickle 更快也更安全
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+
+
+class _CacheFileEntry(msgspec.Struct):
+    """缓存文件结构，data 保留为原始 msgpack 字节以便直接复用"""
+
+    data: msgspec.Raw
+    time: float
+    ttl: float
+
+
+_entry_decoder = msgspec.msgpack.Decoder(_CacheFileEntry)
+
+# 缓存文件名版本前缀，旧版 MD5 命名的文件不会被误读
+_CACHE_KEY_VERSION = "v2_"
+
+# 写入中途崩溃遗留的临时文件，超过该时长（秒）后由 cleanup 删除
+_TMP_FILE_MAX_AGE = 600
+
+# 文件头：8 字节小端 double 过期时间戳，清理时只需读文件头即可判断是否过期
+_HEADER = struct.Struct("<d")
+
+
+class _LoadAbandoned(Exception):
+    """get_or_set 中负责加载的调用被取消，通知等待者重新加载"""
+
 
 class CacheManager:
     """通用缓存管理器 - 支持内存和文件双重缓存"""
 
-    def __init__(self, cache_dir: str = "/tmp/xiaomusic_cache", default_ttl: int = 3600):
+    def __init__(
+        self,
+        cache_dir: str = "/tmp/xiaomusic_cache",
+        default_ttl: int = 3600,
+        max_entries: int = 10000,
+    ):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.default_ttl = default_ttl
-        self.memory_cache: Dict[str, Dict[str, Any]] = {}
+        # 内存缓存按 LRU 淘汰，避免长时间运行后无限增长
+        self.max_entries = max_entries
+        self.memory_cache: collections.OrderedDict[str, dict[str, Any]] = (
+            collections.OrderedDict()
+        )
+        # 同一个键（如 duration:<filename>）会被反复查询，缓存键到路径的映射
+        self._get_cache_path = functools.lru_cache(maxsize=4096)(
+            self._get_cache_path
+        )
+        # 正在加载中的键，并发未命中时共享同一次加载结果
+        self._inflight: dict[str, asyncio.Future] = {}
         self.log = logging.getLogger(__name__)
 
     def _get_cache_key(self, key: str) -> str:
-        """生成缓存键的哈希"""
-        return hashlib.md5(key.encode()).hexdigest()
+        """生成缓存键的哈希（BLAKE2b-128，比 MD5 更快）"""
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
 
     def _get_cache_path(self, key: str) -> Path:
         """获取缓存文件路径"""
-        cache_key = self._get_cache_key(key)
-        return self.cache_dir / f"{cache_key}.cache"
+        return self._get_cache_path_by_digest(self._get_cache_key(key))
+
+    def _get_cache_path_by_digest(self, digest: str) -> Path:
+        """根据已算好的键哈希获取缓存文件路径
 
-    async def get(self, key: str, ttl: Optional[int] = None) -> Optional[Any]:
+        按哈希首字节分到 256 个子目录，避免单个目录下文件过多
+        """
+        return self.cache_dir / digest[:2] / f"{_CACHE_KEY_VERSION}{digest}.cache"
+
+    @staticmethod
+    def _is_tmp_file(name: str) -> bool:
+        """是否为写入缓存时使用的临时文件"""
+        return ".cache.tmp." in name
+
+    def _scan_cache_files(self) -> Iterator[os.DirEntry]:
+        """遍历所有缓存文件（包括旧版未分目录的文件和遗留的临时文件）"""
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    with os.scandir(entry.path) as shard_it:
+                        for shard_entry in shard_it:
+                            name = shard_entry.name
+                            if name.endswith(".cache") or self._is_tmp_file(name):
+                                yield shard_entry
+                elif entry.name.endswith(".cache"):
+                    yield entry
+
+    def _read_cache_file(self, cache_path: Path) -> dict[str, Any] | None:
+        """读取并解码缓存文件（阻塞，需在线程中调用）
+
+        文件无法解码时视为未命中并删除，不会尝试用 pickle 等不安全方式读取
+        """
+        with open(cache_path, "rb") as f:
+            raw = f.read()
+        try:
+            entry = _entry_decoder.decode(memoryview(raw)[_HEADER.size :])
+            encoded = bytes(entry.data)
+            data = _decoder.decode(encoded)
+        except msgspec.DecodeError:
+            try:
+                os.unlink(cache_path)
+            except FileNotFoundError:
+                pass
+            return None
+        return {
+            "data": data,
+            "encoded": encoded,
+            "time": entry.time,
+            "ttl": entry.ttl,
+        }
+
+    def _write_cache_file(self, cache_path: Path, cache_data: dict[str, Any]) -> None:
+        """编码并写入缓存文件（阻塞，需在线程中调用）
+
+        编码结果回填到 cache_data["encoded"]，供 get_encoded 复用
+        """
+        encoded = _encoder.encode(cache_data["data"])
+        cache_data["encoded"] = encoded
+        expire_at = cache_data["time"] + cache_data["ttl"]
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，避免读到写了一半的缓存
+        tmp_path = cache_path.with_name(
+            f"{cache_path.name}.tmp.{os.getpid()}.{threading.get_ident()}"
+        )
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(expire_at))
+                f.write(
+                    _encoder.encode(
+                        {
+                            "data": msgspec.Raw(encoded),
+                            "time": cache_data["time"],
+                            "ttl": cache_data["ttl"],
+                        }
+                    )
+                )
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _remember(self, key: str, cache_data: dict[str, Any]) -> None:
+        """写入内存缓存，超出容量时淘汰最久未使用的条目"""
+        self.memory_cache[key] = cache_data
+        self.memory_cache.move_to_end(key)
+        while len(self.memory_cache) > self.max_entries:
+            self.memory_cache.popitem(last=False)
+
+    async def get(self, key: str, ttl: int | None = None) -> Any | None:
         """获取缓存
 
         Args:
             key: 缓存键
-            ttl: 缓存有效期（秒），默认使用 default_ttl
+            ttl: 已废弃，过期时间以写入时保存的 ttl 为准
 
         Returns:
             缓存数据或 None
         """
-        ttl = ttl or self.default_ttl
+        cache_data = await self._get_entry(key)
+        return None if cache_data is None else cache_data["data"]
+
+    async def get_encoded(self, key: str) -> bytes | None:
+        """获取缓存数据的 msgpack 编码字节，免去重复序列化
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            msgpack 字节或 None
+        """
+        cache_data = await self._get_entry(key)
+        if cache_data is None:
+            return None
+        if cache_data["encoded"] is None:
+            # 文件尚未写完或写入失败时，按需编码一次
+            try:
+                cache_data["encoded"] = _encoder.encode(cache_data["data"])
+            except (TypeError, msgspec.EncodeError):
+                return None
+        return cache_data["encoded"]
+
+    async def _get_entry(self, key: str) -> dict[str, Any] | None:
+        """按键查找未过期的缓存条目，先查内存再查文件"""
         current_time = time.time()
 
         # 先检查内存缓存
         if key in self.memory_cache:
             cache_data = self.memory_cache[key]
             if current_time - cache_data["time"] < cache_data["ttl"]:
+                self.memory_cache.move_to_end(key)
                 self.log.debug(f"命中内存缓存: {key}")
-                return cache_data["data"]
+                return cache_data
             del self.memory_cache[key]
 
         # 检查文件缓存
+        # 直接打开文件，不存在时由 FileNotFoundError 判定未命中，省去一次 stat
         cache_path = self._get_cache_path(key)
-        if cache_path.exists():
-            try:
-                with open(cache_path, "rb") as f:
-                    cache_data = pickle.load(f)
-
-                if current_time - cache_data["time"] < ttl:
-                    # 同时更新内存缓存
-                    self.memory_cache[key] = cache_data
-                    self.log.debug(f"命中文件缓存: {key}")
-                    return cache_data["data"]
-                else:
-                    # 缓存过期
-                    cache_path.unlink()
-                    self.log.debug(f"缓存过期已删除: {key}")
-            except Exception as e:
-                self.log.warning(f"读取缓存失败 {key}: {e}")
-
+        try:
+            cache_data = await asyncio.to_thread(self._read_cache_file, cache_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.log.warning(f"读取缓存失败 {key}: {e}")
+            return None
+        if cache_data is None:
+            self.log.warning(f"缓存文件损坏已删除: {key}")
+            return None
+
+        if current_time - cache_data["time"] < cache_data["ttl"]:
+            # 同时更新内存缓存
+            self._remember(key, cache_data)
+            self.log.debug(f"命中文件缓存: {key}")
+            return cache_data
+
+        # 缓存过期
+        try:
+            os.unlink(cache_path)
+            self.log.debug(f"缓存过期已删除: {key}")
+        except FileNotFoundError:
+            pass
         return None
 
     async def set(
-        self, key: str, data: Any, ttl: Optional[int] = None
+        self, key: str, data: Any, ttl: int | None = None
     ) -> None:
         """设置缓存
 
+        数据以 msgpack 编码保存到文件：命中内存时返回写入的原对象，
+        命中文件时返回解码结果（tuple、set 等会变为 list）；无法编码的数据不会被缓存
+
         Args:
             key: 缓存键
             data: 缓存数据
             ttl: 缓存有效期（秒），默认使用 default_ttl
         """
-        ttl = ttl or self.default_ttl
+        cache_path = self._get_cache_path(key)
+        ttl = self.default_ttl if ttl is None else max(ttl, 0)
         cache_data = {
             "data": data,
+            "encoded": None,
             "time": time.time(),
             "ttl": ttl,
         }
 
         # 保存到内存
-        self.memory_cache[key] = cache_data
+        self._remember(key, cache_data)
 
-        # 保存到文件
-        cache_path = self._get_cache_path(key)
+        # 编码和写文件都在线程中完成，不阻塞事件循环
         try:
-            with open(cache_path, "wb") as f:
-                pickle.dump(cache_data, f)
+            await asyncio.to_thread(self._write_cache_file, cache_path, cache_data)
             self.log.debug(f"已缓存: {key}")
+        except (TypeError, msgspec.EncodeError) as e:
+            # 不能缓存新值时也不能继续返回旧值
+            self.log.warning(f"缓存数据无法编码 {key}: {e}")
+            if self.memory_cache.get(key) is cache_data:
+                del self.memory_cache[key]
+            try:
+                os.unlink(cache_path)
+            except FileNotFoundError:
+                pass
         except Exception as e:
             self.log.warning(f"保存缓存失败 {key}: {e}")
 
-    async def clear(self, key: Optional[str] = None) -> None:
+    async def get_or_set(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: int | None = None,
+    ) -> Any:
+        """获取缓存，未命中时调用 loader 加载并写入缓存
+
+        同一个键并发未命中时只会调用一次 loader，其余调用等待同一结果。
+        get 以 None 表示未命中，因此 loader 返回 None 时不会写入缓存，
+        下次调用会重新加载
+
+        Args:
+            key: 缓存键
+            loader: 无参异步函数，返回要缓存的数据
+            ttl: 缓存有效期（秒），默认使用 default_ttl
+
+        Returns:
+            缓存数据
+        """
+        while True:
+            data = await self.get(key)
+            if data is not None:
+                return data
+
+            fut = self._inflight.get(key)
+            if fut is not None:
+                try:
+                    return await asyncio.shield(fut)
+                except _LoadAbandoned:
+                    # 负责加载的调用被取消，由等待者重新发起加载
+                    continue
+
+            fut = asyncio.get_running_loop().create_future()
+            self._inflight[key] = fut
+            try:
+                data = await loader()
+                # 先唤醒等待者，不让它们等文件写完
+                fut.set_result(data)
+                if data is not None:
+                    await self.set(key, data, ttl)
+                return data
+            except asyncio.CancelledError:
+                # 不取消共享的 future，否则所有等待者都会收到 CancelledError
+                if not fut.done():
+                    fut.set_exception(_LoadAbandoned())
+                    fut.exception()
+                raise
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+                    # 标记异常已被读取，没有等待者时避免 "never retrieved" 警告
+                    fut.exception()
+                raise
+            finally:
+                self._inflight.pop(key, None)
+
+    async def clear(self, key: str | None = None) -> None:
         """清除缓存
 
         Args:
@@ -116,37 +354,52 @@ class CacheManager:
             # 清除指定键
             if key in self.memory_cache:
                 del self.memory_cache[key]
-            cache_path = self._get_cache_path(key)
-            if cache_path.exists():
-                cache_path.unlink()
+            try:
+                os.unlink(self._get_cache_path(key))
+            except FileNotFoundError:
+                pass
             self.log.info(f"已清除缓存: {key}")
         else:
             # 清除所有缓存
             self.memory_cache.clear()
-            for cache_file in self.cache_dir.glob("*.cache"):
+            for entry in self._scan_cache_files():
                 try:
-                    cache_file.unlink()
+                    os.unlink(entry.path)
                 except Exception as e:
                     self.log.warning(f"删除缓存文件失败: {e}")
             self.log.info("已清除所有缓存")
 
-    def cleanup(self) -> None:
-        """清理过期缓存（同步方法，适合在后台任务中调用）"""
+    async def cleanup(self) -> None:
+        """清理过期缓存（在线程池中执行，不阻塞事件循环）"""
+        await asyncio.to_thread(self._cleanup_sync)
+
+    def _cleanup_sync(self) -> None:
+        """清理过期缓存的同步实现"""
         current_time = time.time()
         cleaned = 0
 
-        for cache_file in self.cache_dir.glob("*.cache"):
-            try:
-                with open(cache_file, "rb") as f:
-                    cache_data = pickle.load(f)
+        for entry in self._scan_cache_files():
+            if self._is_tmp_file(entry.name):
+                # 临时文件可能正在被写入，只删除足够旧的
+                try:
+                    expired = current_time - entry.stat().st_mtime > _TMP_FILE_MAX_AGE
+                except FileNotFoundError:
+                    continue
+            elif not entry.name.startswith(_CACHE_KEY_VERSION):
+                # 旧版命名的文件不会再被读取，直接删除
+                expired = True
+            else:
+                try:
+                    with open(entry.path, "rb") as f:
+                        (expire_at,) = _HEADER.unpack(f.read(_HEADER.size))
+                    expired = current_time >= expire_at
+                except Exception:
+                    # 损坏的缓存文件也删除
+                    expired = True
 
-                if current_time - cache_data["time"] > cache_data["ttl"]:
-                    cache_file.unlink()
-                    cleaned += 1
-            except Exception:
-                # 损坏的缓存文件也删除
+            if expired:
                 try:
-                    cache_file.unlink()
+                    os.unlink(entry.path)
                     cleaned += 1
                 except Exception:
                     pass
@@ -168,11 +421,16 @@ class MusicListCache:
         self.cache = cache_manager
         self.log = logging.getLogger(__name__)
 
-    async def get_all_music(self, force_refresh: bool = False) -> Optional[list]:
+    async def get_all_music(
+        self,
+        force_refresh: bool = False,
+        loader: Callable[[], Awaitable[list]] | None = None,
+    ) -> list | None:
         """获取全部音乐列表
 
         Args:
             force_refresh: 是否强制刷新
+            loader: 缓存未命中时用于重建列表的异步函数，并发请求只会重建一次
 
         Returns:
             音乐列表或 None
@@ -180,7 +438,11 @@ class MusicListCache:
         if force_refresh:
             await self.cache.clear("all_music_list")
             self.log.info("强制刷新音乐列表缓存")
-        return await self.cache.get("all_music_list", ttl=self.MUSIC_LIST_TTL)
+        if loader is not None:
+            return await self.cache.get_or_set(
+                "all_music_list", loader, ttl=self.MUSIC_LIST_TTL
+            )
+        return await self.cache.get("all_music_list")
 
     async def set_all_music(self, music_list: list) -> None:
         """设置全部音乐列表
@@ -191,7 +453,7 @@ class MusicListCache:
         await self.cache.set("all_music_list", music_list, ttl=self.MUSIC_LIST_TTL)
         self.log.info(f"已缓存音乐列表: {len(music_list)} 首歌曲")
 
-    async def get_duration(self, filename: str) -> Optional[float]:
+    async def get_duration(self, filename: str) -> float | None:
         """获取歌曲时长
 
         Args:
@@ -200,7 +462,7 @@ class MusicListCache:
         Returns:
             时长（秒）或 None
         """
-        return await self.cache.get(f"duration:{filename}", ttl=self.DURATION_TTL)
+        return await self.cache.get(f"duration:{filename}")
 
     async def set_duration(self, filename: str, duration: float) -> None:
         """设置歌曲时长
@@ -214,33 +476,34 @@ class MusicListCache:
         )
         self.log.debug(f"已缓存时长: {filename} = {duration}s")
 
-    async def get_duration_batch(self, filenames: list) -> dict:
+    async def get_duration_batch(self, filenames: list) -> tuple[dict, list]:
         """批量获取歌曲时长
 
         Args:
             filenames: 文件名列表
 
         Returns:
-            文件名到时长的映射
+            (文件名到时长的映射, 未命中缓存的文件名列表)
         """
         result = {}
         uncached = []
 
-        # 先从缓存获取
-        for filename in filenames:
-            duration = await self.get_duration(filename)
+        # 并发从缓存获取
+        durations = await asyncio.gather(
+            *[self.get_duration(filename) for filename in filenames]
+        )
+        for filename, duration in zip(filenames, durations):
             if duration is not None:
                 result[filename] = duration
             else:
                 uncached.append(filename)
 
-        result["uncached"] = uncached
-        return result
+        return result, uncached
 
 
 # 全局单例
-_cache_manager: Optional[CacheManager] = None
-_music_list_cache: Optional[MusicListCache] = None
+_cache_manager: CacheManager | None = None
+_music_list_cache: MusicListCache | None = None
 
 
 def get_cache_manager(config_path: str = "/tmp/xiaomusic_cache") -> CacheManager: